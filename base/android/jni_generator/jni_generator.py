@@ -8,10 +8,11 @@ If you change this, please run and update the tests."""
 
 import collections
 import errno
+import functools
+import itertools
 import optparse
 import os
 import re
-from string import Template
 import subprocess
 import sys
 import textwrap
@@ -28,9 +29,9 @@ from util import build_utils
 
 
 # Match single line comments, multiline comments, character literals, and
-# double-quoted strings.
+# double-quoted strings. The whole match is captured so that split() keeps it.
 _COMMENT_REMOVER_REGEX = re.compile(
-    r'//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*"',
+    r'(//.*?$|/\*.*?\*/|\'(?:\\.|[^\\\'])*\'|"(?:\\.|[^\\"])*")',
     re.DOTALL | re.MULTILINE)
 
 _EXTRACT_NATIVES_REGEX = re.compile(
@@ -39,21 +40,61 @@ _EXTRACT_NATIVES_REGEX = re.compile(
     r'(@NativeCall(\(\"(?P<java_class_name>.*?)\"\))\s+)?'
     r'(?P<qualifiers>\w+\s\w+|\w+|\s+)\s*native '
     r'(?P<return_type>\S*) '
-    r'(?P<name>native\w+)\((?P<params>.*?)\);')
+    r'(?P<name>native\w+)\((?P<params>.*?)\);',
+    re.DOTALL)
 
 _MAIN_DEX_REGEX = re.compile(
     r'^\s*(?:@(?:\w+\.)*\w+\s+)*@MainDex\b',
     re.MULTILINE)
 
+_IMPORT_REGEX = re.compile(r'import.*?(?P<class>\S*?);', re.DOTALL)
+
+_INNER_CLASS_REGEX = re.compile(
+    r'(class|interface|enum)\s+?(?P<name>\w+?)\W')
+
+_ADDITIONAL_IMPORTS_REGEX = re.compile(
+    r'@JNIAdditionalImport\(\s*{?(?P<class_names>.*?)}?\s*\)', re.DOTALL)
+
+_JNI_NAMESPACE_REGEX = re.compile(r'@JNINamespace\("(.*?)"\)')
+
+_PACKAGE_REGEX = re.compile(r'package (.*?);')
+
+# Regex to match the JNI types that should be wrapped in a JavaRef.
+RE_SCOPED_JNI_TYPES = re.compile('jobject|jclass|jstring|jthrowable|.*Array')
+
+# Regexes used to parse the output of javap.
+_JAVAP_CLASS_NAME_REGEX = re.compile(
+    r'.*?(public).*?(class|interface) (?P<class_name>\S+?)( |\Z)')
+
+_JAVAP_METHOD_REGEX = re.compile(
+    r'(?P<prefix>.*?)(?P<return_type>\S+?) (?P<name>\w+?)'
+    r'\((?P<params>.*?)\)')
+
+_JAVAP_CONSTANT_FIELD_REGEX = re.compile(
+    r'.*?public static final int (?P<name>.*?);')
+
+_JAVAP_CONSTANT_FIELD_VALUE_REGEX = re.compile(
+    r'.*?Constant(Value| value): int (?P<value>(-*[0-9]+)?)')
+
 # Use 100 columns rather than 80 because it makes many lines more readable.
 _WRAP_LINE_LENGTH = 100
-# WrapOutput() is fairly slow. Pre-creating TextWrappers helps a bit.
-_WRAPPERS_BY_INDENT = [
-    textwrap.TextWrapper(width=_WRAP_LINE_LENGTH, expand_tabs=False,
-                         replace_whitespace=False,
-                         subsequent_indent=' ' * (indent + 4),
-                         break_long_words=False)
-    for indent in xrange(50)]  # 50 chosen experimentally.
+# WrapOutput() is fairly slow. Reusing TextWrappers helps a bit. They are
+# created on first use since only a handful of indents ever show up.
+_WRAPPERS_BY_INDENT = {}
+
+
+def _Memoize(func):
+  """Caches the results of a function that takes a single hashable arg."""
+  cache = {}
+
+  @functools.wraps(func)
+  def Wrapper(arg):
+    result = cache.get(arg)
+    if result is None:
+      result = func(arg)
+      cache[arg] = result
+    return result
+  return Wrapper
 
 
 class ParseError(Exception):
@@ -126,36 +167,55 @@ class ConstantField(object):
     self.value = kwargs['value']
 
 
+_JAVA_POD_TYPE_MAP = {
+    'int': 'jint',
+    'byte': 'jbyte',
+    'char': 'jchar',
+    'short': 'jshort',
+    'boolean': 'jboolean',
+    'long': 'jlong',
+    'double': 'jdouble',
+    'float': 'jfloat',
+}
+
+_JAVA_TYPE_MAP = {
+    'void': 'void',
+    'String': 'jstring',
+    'Class': 'jclass',
+    'Throwable': 'jthrowable',
+    'java/lang/String': 'jstring',
+    'java/lang/Class': 'jclass',
+    'java/lang/Throwable': 'jthrowable',
+}
+
+# All the java types with a direct C equivalent.
+_JAVA_TO_C_TYPE_MAP = dict(_JAVA_POD_TYPE_MAP)
+_JAVA_TO_C_TYPE_MAP.update(_JAVA_TYPE_MAP)
+
+_JAVA_POD_RETURN_VALUE_MAP = {
+    'int': '0',
+    'byte': '0',
+    'char': '0',
+    'short': '0',
+    'boolean': 'false',
+    'long': '0',
+    'double': '0',
+    'float': '0',
+    'void': ''
+}
+
+
+@_Memoize
 def JavaDataTypeToC(java_type):
   """Returns a C datatype for the given java type."""
-  java_pod_type_map = {
-      'int': 'jint',
-      'byte': 'jbyte',
-      'char': 'jchar',
-      'short': 'jshort',
-      'boolean': 'jboolean',
-      'long': 'jlong',
-      'double': 'jdouble',
-      'float': 'jfloat',
-  }
-  java_type_map = {
-      'void': 'void',
-      'String': 'jstring',
-      'Class': 'jclass',
-      'Throwable': 'jthrowable',
-      'java/lang/String': 'jstring',
-      'java/lang/Class': 'jclass',
-      'java/lang/Throwable': 'jthrowable',
-  }
-
   java_type = _StripGenerics(java_type)
-  if java_type in java_pod_type_map:
-    return java_pod_type_map[java_type]
-  elif java_type in java_type_map:
-    return java_type_map[java_type]
-  elif java_type.endswith('[]'):
-    if java_type[:-2] in java_pod_type_map:
-      return java_pod_type_map[java_type[:-2]] + 'Array'
+  c_type = _JAVA_TO_C_TYPE_MAP.get(java_type)
+  if c_type:
+    return c_type
+  elif java_type[-2:] == '[]':
+    c_type = _JAVA_POD_TYPE_MAP.get(java_type[:-2])
+    if c_type:
+      return c_type + 'Array'
     return 'jobjectArray'
   else:
     return 'jobject'
@@ -163,24 +223,26 @@ def JavaDataTypeToC(java_type):
 
 def WrapCTypeForDeclaration(c_type):
   """Wrap the C datatype in a JavaRef if required."""
-  if re.match(RE_SCOPED_JNI_TYPES, c_type):
+  if RE_SCOPED_JNI_TYPES.match(c_type):
     return 'const base::android::JavaParamRef<' + c_type + '>&'
   else:
     return c_type
 
 
+@_Memoize
 def _JavaDataTypeToCForDeclaration(java_type):
   """Returns a JavaRef-wrapped C datatype for the given java type."""
   return WrapCTypeForDeclaration(JavaDataTypeToC(java_type))
 
 
+@_Memoize
 def JavaDataTypeToCForCalledByNativeParam(java_type):
   """Returns a C datatype to be when calling from native."""
   if java_type == 'int':
     return 'JniIntWrapper'
   else:
     c_type = JavaDataTypeToC(java_type)
-    if re.match(RE_SCOPED_JNI_TYPES, c_type):
+    if RE_SCOPED_JNI_TYPES.match(c_type):
       return 'const base::android::JavaRef<' + c_type + '>&'
     else:
       return c_type
@@ -188,31 +250,32 @@ def JavaDataTypeToCForCalledByNativeParam(java_type):
 
 def JavaReturnValueToC(java_type):
   """Returns a valid C return value for the given java type."""
-  java_pod_type_map = {
-      'int': '0',
-      'byte': '0',
-      'char': '0',
-      'short': '0',
-      'boolean': 'false',
-      'long': '0',
-      'double': '0',
-      'float': '0',
-      'void': ''
-  }
-  return java_pod_type_map.get(java_type, 'NULL')
+  return _JAVA_POD_RETURN_VALUE_MAP.get(java_type, 'NULL')
+
+
+# Maps (native.type, native.static) to the C type of the jcaller parameter.
+_JNI_FIRST_PARAM_TYPES = {
+    ('function', False): 'jobject',
+    ('function', True): 'jclass',
+    ('method', False): 'jobject',
+    ('method', True): 'jobject',
+}
 
 
 def _GetJNIFirstParamType(native):
-  if native.type == 'function' and native.static:
-    return 'jclass'
-  return 'jobject'
+  return _JNI_FIRST_PARAM_TYPES[(native.type, native.static)]
+
+
+# Maps (first param C type, for_declaration) to the jcaller parameter.
+_JNI_FIRST_PARAMS = dict(
+    ((c_type, for_declaration),
+     (WrapCTypeForDeclaration(c_type) if for_declaration else c_type) +
+     ' jcaller')
+    for c_type in ('jclass', 'jobject') for for_declaration in (False, True))
 
 
 def _GetJNIFirstParam(native, for_declaration):
-  c_type = _GetJNIFirstParamType(native)
-  if for_declaration:
-    c_type = WrapCTypeForDeclaration(c_type)
-  return [c_type + ' jcaller']
+  return _JNI_FIRST_PARAMS[(_GetJNIFirstParamType(native), for_declaration)]
 
 
 def _GetParamsInDeclaration(native):
@@ -224,27 +287,35 @@ def _GetParamsInDeclaration(native):
   Returns:
     A string containing the params.
   """
-  return ',\n    '.join(_GetJNIFirstParam(native, True) +
-                        [_JavaDataTypeToCForDeclaration(param.datatype) + ' ' +
-                         param.name
-                         for param in native.params])
+  return ',\n    '.join(itertools.chain(
+      (_GetJNIFirstParam(native, True),),
+      (_JavaDataTypeToCForDeclaration(param.datatype) + ' ' + param.name
+       for param in native.params)))
 
 
-def GetParamsInStub(native):
+def GetParamsInStub(native, param_c_types=None):
   """Returns the params for the stub declaration.
 
   Args:
     native: the native dictionary describing the method.
+    param_c_types: optional list with the C type of each of native.params, for
+      callers that have already computed them.
 
   Returns:
     A string containing the params.
   """
-  params = [JavaDataTypeToC(p.datatype) + ' ' + p.name for p in native.params]
-  return ',\n    '.join(_GetJNIFirstParam(native, False) + params)
+  if param_c_types is None:
+    param_c_types = [JavaDataTypeToC(p.datatype) for p in native.params]
+  return ',\n    '.join(itertools.chain(
+      (_GetJNIFirstParam(native, False),),
+      (c_type + ' ' + p.name
+       for c_type, p in itertools.izip(param_c_types, native.params))))
 
 
 def _StripGenerics(value):
   """Strips Java generics from a string."""
+  if '<' not in value:
+    return value
   nest_level = 0  # How deeply we are nested inside the generics.
   start_index = 0  # Starting index of the last non-generic region.
   out = []
@@ -262,60 +333,95 @@ def _StripGenerics(value):
   return ''.join(out)
 
 
+_JNI_POD_PARAM_MAP = {
+    'int': 'I',
+    'boolean': 'Z',
+    'char': 'C',
+    'short': 'S',
+    'long': 'J',
+    'double': 'D',
+    'float': 'F',
+    'byte': 'B',
+    'void': 'V',
+}
+
+_OBJECT_PARAM_LIST = (
+    'Ljava/lang/Boolean',
+    'Ljava/lang/Integer',
+    'Ljava/lang/Long',
+    'Ljava/lang/Object',
+    'Ljava/lang/String',
+    'Ljava/lang/Class',
+    'Ljava/lang/CharSequence',
+    'Ljava/lang/Runnable',
+    'Ljava/lang/Throwable',
+)
+
+
 class JniParams(object):
   """Get JNI related parameters."""
 
+  # Maps the simple name of each implicitly imported class to its fully
+  # qualified name. It is loaded once and shared by all instances, so that
+  # processing many files in one process reads android_jar.classes only once.
+  _implicit_imports = {}
+  _implicit_imports_loaded = False
+
   def __init__(self, fully_qualified_class):
     self._fully_qualified_class = 'L' + fully_qualified_class
-    self._package = '/'.join(fully_qualified_class.split('/')[:-1])
+    self._package = fully_qualified_class.rpartition('/')[0]
     self._imports = []
     self._inner_classes = []
-    self._implicit_imports = []
+    # Maps simple class names to the first of the object params, this class
+    # and its inner classes which they resolve to.
+    self._qualified_by_suffix = {}
+    for qualified_name in itertools.chain(_OBJECT_PARAM_LIST,
+                                          (self._fully_qualified_class,)):
+      self._AddQualifiedBySuffix(qualified_name)
+    # Maps java types to their JNI signature type. The conversion depends on
+    # the imports and inner classes, so it is cleared whenever those change.
+    self._java_to_jni_cache = {}
+    # Maps (param datatypes, return type) to the JNI types of the signature.
+    self._signature_jni_types_cache = {}
+    # Maps (param datatypes, return type) to the JNI signature.
+    self._signature_cache = {}
 
   def ExtractImportsAndInnerClasses(self, contents):
-    contents = contents.replace('\n', '')
-    re_import = re.compile(r'import.*?(?P<class>\S*?);')
-    for match in re.finditer(re_import, contents):
-      self._imports += ['L' + match.group('class').replace('.', '/')]
+    self._ClearJniTypeCaches()
+    for match in _IMPORT_REGEX.finditer(contents):
+      self._imports.append('L' + match.group('class').replace('.', '/'))
 
-    re_inner = re.compile(r'(class|interface|enum)\s+?(?P<name>\w+?)\W')
-    for match in re.finditer(re_inner, contents):
+    for match in _INNER_CLASS_REGEX.finditer(contents):
       inner = match.group('name')
       if not self._fully_qualified_class.endswith(inner):
-        self._inner_classes += [self._fully_qualified_class + '$' +
-                                     inner]
+        inner_class = self._fully_qualified_class + '$' + inner
+        self._inner_classes.append(inner_class)
+        self._AddQualifiedBySuffix(inner_class)
 
-    re_additional_imports = re.compile(
-        r'@JNIAdditionalImport\(\s*{?(?P<class_names>.*?)}?\s*\)')
-    for match in re.finditer(re_additional_imports, contents):
+    for match in _ADDITIONAL_IMPORTS_REGEX.finditer(contents):
       for class_name in match.group('class_names').split(','):
         self._AddAdditionalImport(class_name.strip())
 
+  def _AddQualifiedBySuffix(self, qualified_name):
+    index = max(qualified_name.rfind('/'), qualified_name.rfind('$'))
+    # Names without a package only have the 'L' prefix to skip.
+    suffix = qualified_name[index + 1:] if index != -1 else qualified_name[1:]
+    self._qualified_by_suffix.setdefault(suffix, qualified_name)
+
+  def _ClearJniTypeCaches(self):
+    self._java_to_jni_cache.clear()
+    self._signature_jni_types_cache.clear()
+    self._signature_cache.clear()
+
   def JavaToJni(self, param):
     """Converts a java param into a JNI signature type."""
-    pod_param_map = {
-        'int': 'I',
-        'boolean': 'Z',
-        'char': 'C',
-        'short': 'S',
-        'long': 'J',
-        'double': 'D',
-        'float': 'F',
-        'byte': 'B',
-        'void': 'V',
-    }
-    object_param_list = [
-        'Ljava/lang/Boolean',
-        'Ljava/lang/Integer',
-        'Ljava/lang/Long',
-        'Ljava/lang/Object',
-        'Ljava/lang/String',
-        'Ljava/lang/Class',
-        'Ljava/lang/CharSequence',
-        'Ljava/lang/Runnable',
-        'Ljava/lang/Throwable',
-    ]
+    jni_type = self._java_to_jni_cache.get(param)
+    if jni_type is None:
+      jni_type = self._JavaToJni(param)
+      self._java_to_jni_cache[param] = jni_type
+    return jni_type
 
+  def _JavaToJni(self, param):
     prefix = ''
     # Array?
     while param[-2:] == '[]':
@@ -324,18 +430,24 @@ class JniParams(object):
     # Generic?
     if '<' in param:
       param = param[:param.index('<')]
-    if param in pod_param_map:
-      return prefix + pod_param_map[param]
+    if param in _JNI_POD_PARAM_MAP:
+      return prefix + _JNI_POD_PARAM_MAP[param]
     if '/' in param:
       # Coming from javap, use the fully qualified param directly.
       return prefix + 'L' + param + ';'
 
-    for qualified_name in (object_param_list +
-                           [self._fully_qualified_class] + self._inner_classes):
-      if (qualified_name.endswith('/' + param) or
-          qualified_name.endswith('$' + param.replace('.', '$')) or
-          qualified_name == 'L' + param):
-        return prefix + qualified_name + ';'
+    qualified_name = self._qualified_by_suffix.get(param)
+    if qualified_name:
+      return prefix + qualified_name + ';'
+    # Dotted names such as Outer.Inner can't be looked up by suffix.
+    if '.' in param or '$' in param:
+      for qualified_name in itertools.chain(_OBJECT_PARAM_LIST,
+                                            (self._fully_qualified_class,),
+                                            self._inner_classes):
+        if (qualified_name.endswith('/' + param) or
+            qualified_name.endswith('$' + param.replace('.', '$')) or
+            qualified_name == 'L' + param):
+          return prefix + qualified_name + ';'
 
     # Is it from an import? (e.g. referecing Class from import pkg.Class;
     # note that referencing an inner class Inner from import pkg.Class.Inner
@@ -382,33 +494,62 @@ class JniParams(object):
     if new_import in self._imports:
       raise SyntaxError('Do not use JNIAdditionalImport on an already '
                         'imported class: %s' % (new_import.replace('/', '.')))
-    self._imports += [new_import]
+    self._ClearJniTypeCaches()
+    self._imports.append(new_import)
+
+  @staticmethod
+  def _LoadImplicitImports():
+    # This file was generated from android.jar and lists
+    # all classes that are implicitly imported.
+    with open(os.path.join(os.path.dirname(sys.argv[0]),
+                           'android_jar.classes'), 'r') as f:
+      for line in f:
+        implicit_import = line.strip().replace('.class', '')
+        implicit_import = implicit_import.replace('/', '.')
+        _, dot, name = implicit_import.rpartition('.')
+        if dot:
+          JniParams._implicit_imports.setdefault(name, implicit_import)
+    JniParams._implicit_imports_loaded = True
 
   def _CheckImplicitImports(self, param):
     # Ensure implicit imports, such as java.lang.*, are not being treated
     # as being in the same package.
-    if not self._implicit_imports:
-      # This file was generated from android.jar and lists
-      # all classes that are implicitly imported.
-      with file(os.path.join(os.path.dirname(sys.argv[0]),
-                             'android_jar.classes'), 'r') as f:
-        self._implicit_imports = f.readlines()
-    for implicit_import in self._implicit_imports:
-      implicit_import = implicit_import.strip().replace('.class', '')
-      implicit_import = implicit_import.replace('/', '.')
-      if implicit_import.endswith('.' + param):
-        raise SyntaxError('Ambiguous class (%s) can not be used directly '
-                          'by JNI.\nPlease import it, probably:\n\n'
-                          'import %s;' %
-                          (param, implicit_import))
+    if not JniParams._implicit_imports_loaded:
+      JniParams._LoadImplicitImports()
+    implicit_import = JniParams._implicit_imports.get(param)
+    if implicit_import:
+      raise SyntaxError('Ambiguous class (%s) can not be used directly '
+                        'by JNI.\nPlease import it, probably:\n\n'
+                        'import %s;' %
+                        (param, implicit_import))
+
+  def SignatureJniTypes(self, params, returns):
+    """Returns the JNI types for the given datatypes.
+
+    Args:
+      params: list of Param.
+      returns: the java return type.
+
+    Returns:
+      A tuple with the JNI type of each param followed by the JNI return type.
+    """
+    key = (tuple(param.datatype for param in params), returns)
+    jni_types = self._signature_jni_types_cache.get(key)
+    if jni_types is None:
+      jni_types = tuple(self.JavaToJni(datatype)
+                        for datatype in itertools.chain(key[0], (returns,)))
+      self._signature_jni_types_cache[key] = jni_types
+    return jni_types
 
   def Signature(self, params, returns):
     """Returns the JNI signature for the given datatypes."""
-    items = ['(']
-    items += [self.JavaToJni(param.datatype) for param in params]
-    items += [')']
-    items += [self.JavaToJni(returns)]
-    return '"{}"'.format(''.join(items))
+    key = (tuple(param.datatype for param in params), returns)
+    signature = self._signature_cache.get(key)
+    if signature is None:
+      jni_types = self.SignatureJniTypes(params, returns)
+      signature = '"({}){}"'.format(''.join(jni_types[:-1]), jni_types[-1])
+      self._signature_cache[key] = signature
+    return signature
 
   @staticmethod
   def ParseJavaPSignature(signature_line):
@@ -436,34 +577,33 @@ class JniParams(object):
       if 'final' in items:
         items.remove('final')
 
+      # Datatypes repeat heavily across a file and are used as cache keys, so
+      # intern them (and the names) to make those lookups cheaper.
       param = Param(
-          datatype=items[0],
-          name=(items[1] if len(items) > 1 else 'p%s' % len(ret)),
+          datatype=intern(items[0]),
+          name=intern(items[1] if len(items) > 1 else 'p%s' % len(ret)),
       )
-      ret += [param]
+      ret.append(param)
     return ret
 
 
 def ExtractJNINamespace(contents):
-  re_jni_namespace = re.compile('.*?@JNINamespace\("(.*?)"\)')
-  m = re.findall(re_jni_namespace, contents)
+  m = _JNI_NAMESPACE_REGEX.search(contents)
   if not m:
     return ''
-  return m[0]
+  return m.group(1)
 
 
 def ExtractFullyQualifiedJavaClassName(java_file_name, contents):
-  re_package = re.compile('.*?package (.*?);')
-  matches = re.findall(re_package, contents)
-  if not matches:
+  match = _PACKAGE_REGEX.search(contents)
+  if not match:
     raise SyntaxError('Unable to find "package" line in %s' % java_file_name)
-  return (matches[0].replace('.', '/') + '/' +
+  return (match.group(1).replace('.', '/') + '/' +
           os.path.splitext(os.path.basename(java_file_name))[0])
 
 
 def ExtractNatives(contents, ptr_type):
   """Returns a list of dict containing information about a native method."""
-  contents = contents.replace('\n', '')
   natives = []
   for match in _EXTRACT_NATIVES_REGEX.finditer(contents):
     native = NativeMethod(
@@ -474,7 +614,7 @@ def ExtractNatives(contents, ptr_type):
         name=match.group('name').replace('native', ''),
         params=JniParams.Parse(match.group('params')),
         ptr_type=ptr_type)
-    natives += [native]
+    natives.append(native)
   return natives
 
 
@@ -489,6 +629,7 @@ def IsMainDexJavaClass(contents):
   return bool(_MAIN_DEX_REGEX.search(contents))
 
 
+@_Memoize
 def GetBinaryClassName(fully_qualified_class):
   """Returns a string concatenating the Java package and class."""
   escaped = fully_qualified_class.replace('_', '_1')
@@ -500,23 +641,27 @@ def GetRegistrationFunctionName(fully_qualified_class):
   return 'RegisterNative_' + GetBinaryClassName(fully_qualified_class)
 
 
+_STATIC_CAST_TYPE_MAP = {
+    'String': 'jstring',
+    'java/lang/String': 'jstring',
+    'Class': 'jclass',
+    'java/lang/Class': 'jclass',
+    'Throwable': 'jthrowable',
+    'java/lang/Throwable': 'jthrowable',
+    'boolean[]': 'jbooleanArray',
+    'byte[]': 'jbyteArray',
+    'char[]': 'jcharArray',
+    'short[]': 'jshortArray',
+    'int[]': 'jintArray',
+    'long[]': 'jlongArray',
+    'float[]': 'jfloatArray',
+    'double[]': 'jdoubleArray',
+}
+
+
 def GetStaticCastForReturnType(return_type):
-  type_map = { 'String' : 'jstring',
-               'java/lang/String' : 'jstring',
-               'Class': 'jclass',
-               'java/lang/Class': 'jclass',
-               'Throwable': 'jthrowable',
-               'java/lang/Throwable': 'jthrowable',
-               'boolean[]': 'jbooleanArray',
-               'byte[]': 'jbyteArray',
-               'char[]': 'jcharArray',
-               'short[]': 'jshortArray',
-               'int[]': 'jintArray',
-               'long[]': 'jlongArray',
-               'float[]': 'jfloatArray',
-               'double[]': 'jdoubleArray' }
   return_type = _StripGenerics(return_type)
-  ret = type_map.get(return_type, None)
+  ret = _STATIC_CAST_TYPE_MAP.get(return_type, None)
   if ret:
     return ret
   if return_type.endswith('[]'):
@@ -524,27 +669,31 @@ def GetStaticCastForReturnType(return_type):
   return None
 
 
+_ENV_CALL_MAP = {
+    'boolean': 'Boolean',
+    'byte': 'Byte',
+    'char': 'Char',
+    'short': 'Short',
+    'int': 'Int',
+    'long': 'Long',
+    'float': 'Float',
+    'void': 'Void',
+    'double': 'Double',
+    'Object': 'Object',
+}
+
+
 def GetEnvCall(is_constructor, is_static, return_type):
   """Maps the types availabe via env->Call__Method."""
   if is_constructor:
     return 'NewObject'
-  env_call_map = {'boolean': 'Boolean',
-                  'byte': 'Byte',
-                  'char': 'Char',
-                  'short': 'Short',
-                  'int': 'Int',
-                  'long': 'Long',
-                  'float': 'Float',
-                  'void': 'Void',
-                  'double': 'Double',
-                  'Object': 'Object',
-                 }
-  call = env_call_map.get(return_type, 'Object')
+  call = _ENV_CALL_MAP.get(return_type, 'Object')
   if is_static:
     call = 'Static' + call
   return 'Call' + call + 'Method'
 
 
+@_Memoize
 def GetMangledParam(datatype):
   """Returns a mangled identifier for the datatype."""
   if len(datatype) <= 2:
@@ -574,9 +723,11 @@ def GetMangledMethodName(jni_params, name, params, return_type):
   Returns:
       A mangled name.
   """
+  jni_types = jni_params.SignatureJniTypes(params, return_type)
   mangled_items = []
-  for datatype in [return_type] + [x.datatype for x in params]:
-    mangled_items += [GetMangledParam(jni_params.JavaToJni(datatype))]
+  # The return type comes first in the mangled name.
+  for jni_type in jni_types[-1:] + jni_types[:-1]:
+    mangled_items.append(GetMangledParam(jni_type))
   mangled_name = name + '_'.join(mangled_items)
   assert re.match(r'[0-9a-zA-Z_]+', mangled_name)
   return mangled_name
@@ -602,10 +753,6 @@ def MangleCalledByNatives(jni_params, called_by_natives):
   return called_by_natives
 
 
-# Regex to match the JNI types that should be wrapped in a JavaRef.
-RE_SCOPED_JNI_TYPES = re.compile('jobject|jclass|jstring|jthrowable|.*Array')
-
-
 # Regex to match a string like "@CalledByNative public void foo(int bar)".
 RE_CALLED_BY_NATIVE = re.compile(
     r'@CalledByNative(?P<Unchecked>(?:Unchecked)?)(?:\("(?P<annotation>.*)"\))?'
@@ -618,9 +765,13 @@ RE_CALLED_BY_NATIVE = re.compile(
     r'\s*(?P<name>\w+)'
     r'\s*\((?P<params>[^\)]*)\)')
 
+# Regex to match empty lines that are indented (i.e. start with 2x spaces).
+_INDENTED_EMPTY_LINES_REGEX = re.compile('^(?: {2})+$\n', re.MULTILINE)
+
+
 # Removes empty lines that are indented (i.e. start with 2x spaces).
 def RemoveIndentedEmptyLines(string):
-  return re.sub('^(?: {2})+$\n', '', string, flags=re.MULTILINE)
+  return _INDENTED_EMPTY_LINES_REGEX.sub('', string)
 
 
 def ExtractCalledByNatives(jni_params, contents):
@@ -638,7 +789,9 @@ def ExtractCalledByNatives(jni_params, contents):
     ParseError: if unable to parse.
   """
   called_by_natives = []
-  for match in re.finditer(RE_CALLED_BY_NATIVE, contents):
+  matched_spans = []
+  for match in RE_CALLED_BY_NATIVE.finditer(contents):
+    matched_spans.append(match.span())
     return_type = match.group('return_type')
     name = match.group('name')
     if not return_type:
@@ -648,7 +801,7 @@ def ExtractCalledByNatives(jni_params, contents):
     else:
       is_constructor = False
 
-    called_by_natives += [CalledByNative(
+    called_by_natives.append(CalledByNative(
         system_class=False,
         unchecked='Unchecked' in match.group('Unchecked'),
         static='static' in match.group('prefix'),
@@ -656,13 +809,22 @@ def ExtractCalledByNatives(jni_params, contents):
         return_type=return_type,
         name=name,
         is_constructor=is_constructor,
-        params=JniParams.Parse(match.group('params')))]
-  # Check for any @CalledByNative occurrences that weren't matched.
-  unmatched_lines = re.sub(RE_CALLED_BY_NATIVE, '', contents).split('\n')
-  for line1, line2 in zip(unmatched_lines, unmatched_lines[1:]):
-    if '@CalledByNative' in line1:
-      raise ParseError('could not parse @CalledByNative method signature',
-                       line1, line2)
+        params=JniParams.Parse(match.group('params'))))
+  # Check for any @CalledByNative occurrences that weren't matched. The
+  # matched spans are sorted and disjoint, so both can be walked together.
+  span_index = 0
+  pos = contents.find('@CalledByNative')
+  while pos != -1:
+    while (span_index < len(matched_spans) and
+           matched_spans[span_index][1] <= pos):
+      span_index += 1
+    if (span_index == len(matched_spans) or
+        pos < matched_spans[span_index][0]):
+      line_start = contents.rfind('\n', 0, pos) + 1
+      raise ParseError('could not parse @CalledByNative method signature '
+                       'at line %d' % (contents.count('\n', 0, pos) + 1),
+                       *contents[line_start:].split('\n', 2)[:2])
+    pos = contents.find('@CalledByNative', pos + 1)
   return MangleCalledByNatives(jni_params, called_by_natives)
 
 
@@ -673,15 +835,11 @@ def RemoveComments(contents):
   # parser. Maybe we could ditch JNIFromJavaSource and just always use
   # JNIFromJavaP; or maybe we could rewrite this script in Java and use APT.
   # http://code.google.com/p/chromium/issues/detail?id=138941
-  def replacer(match):
-    # Replace matches that are comments with nothing; return literals/strings
-    # unchanged.
-    s = match.group(0)
-    if s.startswith('/'):
-      return ''
-    else:
-      return s
-  return _COMMENT_REMOVER_REGEX.sub(replacer, contents)
+  # split() alternates the text between matches with the matches themselves.
+  # Replace matches that are comments with nothing; keep literals/strings.
+  parts = _COMMENT_REMOVER_REGEX.split(contents)
+  parts[1::2] = ['' if s[0] == '/' else s for s in parts[1::2]]
+  return ''.join(parts)
 
 
 class JNIFromJavaP(object):
@@ -691,9 +849,7 @@ class JNIFromJavaP(object):
     self.contents = contents
     self.namespace = options.namespace
     for line in contents:
-      class_name = re.match(
-          '.*?(public).*?(class|interface) (?P<class_name>\S+?)( |\Z)',
-          line)
+      class_name = _JAVAP_CLASS_NAME_REGEX.match(line)
       if class_name:
         self.fully_qualified_class = class_name.group('class_name')
         break
@@ -702,59 +858,65 @@ class JNIFromJavaP(object):
     # away the <...> and use the raw class name that Java 6 would've given us.
     self.fully_qualified_class = self.fully_qualified_class.split('<', 1)[0]
     self.jni_params = JniParams(self.fully_qualified_class)
-    self.java_class_name = self.fully_qualified_class.split('/')[-1]
+    self.java_class_name = self.fully_qualified_class.rpartition('/')[2]
     if not self.namespace:
       self.namespace = 'JNI_' + self.java_class_name
-    re_method = re.compile('(?P<prefix>.*?)(?P<return_type>\S+?) (?P<name>\w+?)'
-                           '\((?P<params>.*?)\)')
-    self.called_by_natives = []
-    for lineno, content in enumerate(contents[2:], 2):
-      match = re.match(re_method, content)
-      if not match:
-        continue
-      self.called_by_natives += [CalledByNative(
-          system_class=True,
-          unchecked=False,
-          static='static' in match.group('prefix'),
-          java_class_name='',
-          return_type=match.group('return_type').replace('.', '/'),
-          name=match.group('name'),
-          params=JniParams.Parse(match.group('params').replace('.', '/')),
-          signature=JniParams.ParseJavaPSignature(contents[lineno + 1]))]
     re_constructor = re.compile('(.*?)public ' +
                                 self.fully_qualified_class.replace('/', '.') +
-                                '\((?P<params>.*?)\)')
-    for lineno, content in enumerate(contents[2:], 2):
-      match = re.match(re_constructor, content)
-      if not match:
-        continue
-      self.called_by_natives += [CalledByNative(
-          system_class=True,
-          unchecked=False,
-          static=False,
-          java_class_name='',
-          return_type=self.fully_qualified_class,
-          name='Constructor',
-          params=JniParams.Parse(match.group('params').replace('.', '/')),
-          signature=JniParams.ParseJavaPSignature(contents[lineno + 1]),
-          is_constructor=True)]
-    self.called_by_natives = MangleCalledByNatives(self.jni_params,
-                                                   self.called_by_natives)
+                                r'\((?P<params>.*?)\)')
+    # Index the signature and constant value lines by line number. They follow
+    # the method and constant field declarations that they describe.
+    signatures = {}
+    constant_values = {}
+    for lineno, content in enumerate(contents):
+      if 'Signature: ' in content or 'descriptor: ' in content:
+        signatures[lineno] = JniParams.ParseJavaPSignature(content)
+      elif 'Constant' in content:
+        value = _JAVAP_CONSTANT_FIELD_VALUE_REGEX.match(content)
+        if value:
+          constant_values[lineno] = value.group('value')
+    # Methods, constructors and constant fields are collected in a single
+    # pass. Constructors are kept after methods to preserve the output order.
+    methods = []
+    constructors = []
     self.constant_fields = []
-    re_constant_field = re.compile('.*?public static final int (?P<name>.*?);')
-    re_constant_field_value = re.compile(
-        '.*?Constant(Value| value): int (?P<value>(-*[0-9]+)?)')
     for lineno, content in enumerate(contents[2:], 2):
-      match = re.match(re_constant_field, content)
+      match = _JAVAP_METHOD_REGEX.match(content)
+      if match:
+        methods.append(CalledByNative(
+            system_class=True,
+            unchecked=False,
+            static='static' in match.group('prefix'),
+            java_class_name='',
+            return_type=match.group('return_type').replace('.', '/'),
+            name=match.group('name'),
+            params=JniParams.Parse(match.group('params').replace('.', '/')),
+            signature=signatures[lineno + 1]))
+        continue
+      match = re_constructor.match(content)
+      if match:
+        constructors.append(CalledByNative(
+            system_class=True,
+            unchecked=False,
+            static=False,
+            java_class_name='',
+            return_type=self.fully_qualified_class,
+            name='Constructor',
+            params=JniParams.Parse(match.group('params').replace('.', '/')),
+            signature=signatures[lineno + 1],
+            is_constructor=True))
+        continue
+      match = _JAVAP_CONSTANT_FIELD_REGEX.match(content)
       if not match:
         continue
-      value = re.match(re_constant_field_value, contents[lineno + 2])
-      if not value:
-        value = re.match(re_constant_field_value, contents[lineno + 3])
-      if value:
+      value = constant_values.get(lineno + 2)
+      if value is None:
+        value = constant_values.get(lineno + 3)
+      if value is not None:
         self.constant_fields.append(
-            ConstantField(name=match.group('name'),
-                          value=value.group('value')))
+            ConstantField(name=match.group('name'), value=value))
+    self.called_by_natives = MangleCalledByNatives(self.jni_params,
+                                                   methods + constructors)
 
     self.inl_header_file_generator = InlHeaderFileGenerator(
         self.namespace, self.fully_qualified_class, [], self.called_by_natives,
@@ -805,12 +967,44 @@ class JNIFromJavaSource(object):
     return JNIFromJavaSource(contents, fully_qualified_class, options)
 
 
+_CLASS_PATH_DECLARATION_TEMPLATE = """
+extern const char kClassPath_%(JAVA_CLASS)s[];
+"""
+
+_CLASS_PATH_DEFINITION_TEMPLATE = """
+JNI_REGISTRATION_EXPORT extern const char kClassPath_%(JAVA_CLASS)s[];
+const char kClassPath_%(JAVA_CLASS)s[] = \
+"%(JNI_CLASS_PATH)s";
+"""
+
+_CLASS_GETTER = """\
+#ifndef %(JAVA_CLASS)s_clazz_defined
+#define %(JAVA_CLASS)s_clazz_defined
+inline jclass %(JAVA_CLASS)s_clazz(JNIEnv* env) {
+  return base::android::LazyGetClass(env, kClassPath_%(JAVA_CLASS)s, \
+&g_%(JAVA_CLASS)s_clazz);
+}
+#endif
+"""
+
+_CLAZZ_DECLARATION_TEMPLATE = """\
+extern base::subtle::AtomicWord g_%(JAVA_CLASS)s_clazz;
+""" + _CLASS_GETTER
+
+_CLAZZ_DEFINITION_TEMPLATE = """\
+// Leaking this jclass as we cannot use LazyInstance from some threads.
+JNI_REGISTRATION_EXPORT base::subtle::AtomicWord g_%(JAVA_CLASS)s_clazz = 0;
+""" + _CLASS_GETTER
+
+
 class HeaderFileGeneratorHelper(object):
   """Include helper methods for header generators."""
 
   def __init__(self, class_name, fully_qualified_class):
     self.class_name = class_name
     self.fully_qualified_class = fully_qualified_class
+    self._binary_class_name = GetBinaryClassName(fully_qualified_class)
+    self._stub_names = {}
 
   def GetStubName(self, native):
     """Return the name of the stub function for this native method.
@@ -821,15 +1015,14 @@ class HeaderFileGeneratorHelper(object):
     Returns:
       A string with the stub function name (used by the JVM).
     """
-    template = Template("Java_${JAVA_NAME}_native${NAME}")
-
-    java_name = self.fully_qualified_class
-    if native.java_class_name:
-      java_name += '$' + native.java_class_name
-
-    values = {'NAME': native.name,
-              'JAVA_NAME': GetBinaryClassName(java_name)}
-    return template.substitute(values)
+    stub_name = self._stub_names.get(native)
+    if stub_name is None:
+      java_name = self._binary_class_name
+      if native.java_class_name:
+        java_name += '_00024' + GetBinaryClassName(native.java_class_name)
+      stub_name = 'Java_%s_native%s' % (java_name, native.name)
+      self._stub_names[native] = stub_name
+    return stub_name
 
   def GetUniqueClasses(self, origin):
     ret = {self.class_name: self.fully_qualified_class}
@@ -844,51 +1037,113 @@ class HeaderFileGeneratorHelper(object):
 
   def GetClassPathLines(self, classes, declare_only=False):
     """Returns the ClassPath constants."""
-    ret = []
     if declare_only:
-      template = Template("""
-extern const char kClassPath_${JAVA_CLASS}[];
-""")
+      class_path_template = _CLASS_PATH_DECLARATION_TEMPLATE
+      clazz_template = _CLAZZ_DECLARATION_TEMPLATE
     else:
-      template = Template("""
-JNI_REGISTRATION_EXPORT extern const char kClassPath_${JAVA_CLASS}[];
-const char kClassPath_${JAVA_CLASS}[] = \
-"${JNI_CLASS_PATH}";
-""")
+      class_path_template = _CLASS_PATH_DEFINITION_TEMPLATE
+      clazz_template = _CLAZZ_DEFINITION_TEMPLATE
 
+    class_path_lines = []
+    clazz_lines = []
     for full_clazz in classes.itervalues():
       values = {
           'JAVA_CLASS': GetBinaryClassName(full_clazz),
           'JNI_CLASS_PATH': full_clazz,
       }
-      ret += [template.substitute(values)]
-
-    class_getter = """\
-#ifndef ${JAVA_CLASS}_clazz_defined
-#define ${JAVA_CLASS}_clazz_defined
-inline jclass ${JAVA_CLASS}_clazz(JNIEnv* env) {
-  return base::android::LazyGetClass(env, kClassPath_${JAVA_CLASS}, \
-&g_${JAVA_CLASS}_clazz);
+      class_path_lines.append(class_path_template % values)
+      clazz_lines.append(clazz_template % values)
+
+    return ''.join(class_path_lines + clazz_lines)
+
+
+_INL_HEADER_TEMPLATE = """\
+// Copyright 2014 The Chromium Authors. All rights reserved.
+// Use of this source code is governed by a BSD-style license that can be
+// found in the LICENSE file.
+
+
+// This file is autogenerated by
+//     %(SCRIPT_NAME)s
+// For
+//     %(FULLY_QUALIFIED_CLASS)s
+
+#ifndef %(HEADER_GUARD)s
+#define %(HEADER_GUARD)s
+
+#include <jni.h>
+
+%(INCLUDES)s
+
+// Step 1: Forward declarations.
+%(CLASS_PATH_DEFINITIONS)s
+
+// Step 2: Constants (optional).
+
+%(CONSTANT_FIELDS)s\
+
+// Step 3: Method stubs.
+%(METHOD_STUBS)s
+
+#endif  // %(HEADER_GUARD)s
+"""
+
+
+_NATIVE_METHOD_STUB_TEMPLATE = """\
+JNI_GENERATOR_EXPORT %(RETURN)s %(STUB_NAME)s(
+    JNIEnv* env,
+    %(PARAMS_IN_STUB)s) {
+%(PROFILING_ENTERED_NATIVE)s\
+%(TRACE_EVENT)s\
+  %(P0_TYPE)s* native = reinterpret_cast<%(P0_TYPE)s*>(%(PARAM0_NAME)s);
+  CHECK_NATIVE_PTR(env, jcaller, native, "%(NAME)s"%(OPTIONAL_ERROR_RETURN)s);
+  return native->%(NAME)s(%(PARAMS_IN_CALL)s)%(POST_CALL)s;
 }
-#endif
 """
-    if declare_only:
-      template = Template("""\
-extern base::subtle::AtomicWord g_${JAVA_CLASS}_clazz;
-""" + class_getter)
-    else:
-      template = Template("""\
-// Leaking this jclass as we cannot use LazyInstance from some threads.
-JNI_REGISTRATION_EXPORT base::subtle::AtomicWord g_${JAVA_CLASS}_clazz = 0;
-""" + class_getter)
 
-    for full_clazz in classes.itervalues():
-      values = {
-          'JAVA_CLASS': GetBinaryClassName(full_clazz),
-      }
-      ret += [template.substitute(values)]
+_NATIVE_FUNCTION_STUB_TEMPLATE = """\
+static %(RETURN_DECLARATION)s %(IMPL_METHOD_NAME)s(JNIEnv* env, %(PARAMS)s);
+
+JNI_GENERATOR_EXPORT %(RETURN)s %(STUB_NAME)s(
+    JNIEnv* env,
+    %(PARAMS_IN_STUB)s) {
+%(PROFILING_ENTERED_NATIVE)s\
+%(TRACE_EVENT)s\
+  return %(IMPL_METHOD_NAME)s(%(PARAMS_IN_CALL)s)%(POST_CALL)s;
+}
+"""
+
+_CALLED_BY_NATIVE_SIGNATURE_TEMPLATE = """\
+static %(RETURN_TYPE)s Java_%(JAVA_CLASS_ONLY)s_%(METHOD_ID_VAR_NAME)s(\
+JNIEnv* env%(FIRST_PARAM_IN_DECLARATION)s%(PARAMS_IN_DECLARATION)s)"""
+
+_CALLED_BY_NATIVE_HEADER_TEMPLATE = """\
+%(FUNCTION_SIGNATURE)s {"""
 
-    return ''.join(ret)
+_CALLED_BY_NATIVE_HEADER_WITH_UNUSED_TEMPLATE = """\
+%(FUNCTION_SIGNATURE)s __attribute__ ((unused));
+%(FUNCTION_SIGNATURE)s {"""
+
+_CALLED_BY_NATIVE_STUB_TEMPLATE = """
+static base::subtle::AtomicWord g_%(JAVA_CLASS)s_%(METHOD_ID_VAR_NAME)s = 0;
+%(FUNCTION_HEADER)s
+  CHECK_CLAZZ(env, %(FIRST_PARAM_IN_CALL)s,
+      %(JAVA_CLASS)s_clazz(env)%(OPTIONAL_ERROR_RETURN)s);
+  jmethodID method_id = base::android::MethodID::LazyGet<
+      base::android::MethodID::TYPE_%(METHOD_ID_TYPE)s>(
+          env, %(JAVA_CLASS)s_clazz(env),
+          "%(JNI_NAME)s",
+          %(JNI_SIGNATURE)s,
+          &g_%(JAVA_CLASS)s_%(METHOD_ID_VAR_NAME)s);
+
+%(TRACE_EVENT)s\
+%(PROFILING_LEAVING_NATIVE)s\
+  %(RETURN_DECLARATION)s
+     %(PRE_CALL)senv->%(ENV_CALL)s(%(FIRST_PARAM_IN_CALL)s,
+          method_id%(PARAMS_IN_CALL)s)%(POST_CALL)s;
+  %(CHECK_EXCEPTION)s
+  %(RETURN_CLAUSE)s
+}"""
 
 
 class InlHeaderFileGenerator(object):
@@ -898,7 +1153,7 @@ class InlHeaderFileGenerator(object):
                called_by_natives, constant_fields, jni_params, options):
     self.namespace = namespace
     self.fully_qualified_class = fully_qualified_class
-    self.class_name = self.fully_qualified_class.split('/')[-1]
+    self.class_name = self.fully_qualified_class.rpartition('/')[2]
     self.natives = natives
     self.called_by_natives = called_by_natives
     self.header_guard = fully_qualified_class.replace('/', '_') + '_JNI'
@@ -907,40 +1162,17 @@ class InlHeaderFileGenerator(object):
     self.options = options
     self.helper = HeaderFileGeneratorHelper(
         self.class_name, fully_qualified_class)
-
+    if namespace:
+      all_namespaces = namespace.split('::')
+      self._open_namespace = '\n'.join(
+          'namespace %s {' % ns for ns in all_namespaces) + '\n'
+      self._close_namespace = '\n' + '\n'.join(
+          '}  // namespace %s' % ns for ns in reversed(all_namespaces))
+    else:
+      self._open_namespace = self._close_namespace = ''
 
   def GetContent(self):
     """Returns the content of the JNI binding file."""
-    template = Template("""\
-// Copyright 2014 The Chromium Authors. All rights reserved.
-// Use of this source code is governed by a BSD-style license that can be
-// found in the LICENSE file.
-
-
-// This file is autogenerated by
-//     ${SCRIPT_NAME}
-// For
-//     ${FULLY_QUALIFIED_CLASS}
-
-#ifndef ${HEADER_GUARD}
-#define ${HEADER_GUARD}
-
-#include <jni.h>
-
-${INCLUDES}
-
-// Step 1: Forward declarations.
-$CLASS_PATH_DEFINITIONS
-
-// Step 2: Constants (optional).
-
-$CONSTANT_FIELDS\
-
-// Step 3: Method stubs.
-$METHOD_STUBS
-
-#endif  // ${HEADER_GUARD}
-""")
     values = {
         'SCRIPT_NAME': self.options.script_name,
         'FULLY_QUALIFIED_CLASS': self.fully_qualified_class,
@@ -961,7 +1193,7 @@ $METHOD_STUBS
         values['CONSTANT_FIELDS'] = '\n'.join([
             open_namespace, constant_fields, close_namespace])
 
-    return WrapOutput(template.substitute(values))
+    return WrapOutput(_INL_HEADER_TEMPLATE % values)
 
   def GetClassPathDefinitionsString(self):
     classes = self.helper.GetUniqueClasses(self.called_by_natives)
@@ -973,17 +1205,17 @@ $METHOD_STUBS
       return ''
     ret = ['enum Java_%s_constant_fields {' % self.class_name]
     for c in self.constant_fields:
-      ret += ['  %s = %s,' % (c.name, c.value)]
+      ret.append('  %s = %s,' % (c.name, c.value))
     ret += ['};', '']
     return '\n'.join(ret)
 
   def GetMethodStubsString(self):
     """Returns the code corresponding to method stubs."""
-    ret = []
-    for native in self.natives:
-      ret += [self.GetNativeStub(native)]
-    ret += self.GetLazyCalledByNativeMethodStubs()
-    return '\n'.join(ret)
+    # Indented empty lines are stripped once over all stubs rather than once
+    # per stub.
+    return RemoveIndentedEmptyLines('\n'.join(itertools.chain(
+        (self.GetNativeStub(native) for native in self.natives),
+        self.GetLazyCalledByNativeMethodStubs())))
 
   def GetLazyCalledByNativeMethodStubs(self):
     return [self.GetLazyCalledByNativeMethodStub(called_by_native)
@@ -996,19 +1228,10 @@ $METHOD_STUBS
     return '\n'.join('#include "%s"' % x for x in includes) + '\n'
 
   def GetOpenNamespaceString(self):
-    if self.namespace:
-      all_namespaces = ['namespace %s {' % ns
-                        for ns in self.namespace.split('::')]
-      return '\n'.join(all_namespaces) + '\n'
-    return ''
+    return self._open_namespace
 
   def GetCloseNamespaceString(self):
-    if self.namespace:
-      all_namespaces = ['}  // namespace %s' % ns
-                        for ns in self.namespace.split('::')]
-      all_namespaces.reverse()
-      return '\n' + '\n'.join(all_namespaces)
-    return ''
+    return self._close_namespace
 
   def GetCalledByNativeParamsInDeclaration(self, called_by_native):
     return ',\n    '.join([
@@ -1017,15 +1240,7 @@ $METHOD_STUBS
         for param in called_by_native.params])
 
   def GetJavaParamRefForCall(self, c_type, name):
-    return Template(
-        'base::android::JavaParamRef<${TYPE}>(env, ${NAME})').substitute({
-        'TYPE': c_type,
-        'NAME': name,
-    })
-
-  def GetJNIFirstParamForCall(self, native):
-    c_type = _GetJNIFirstParamType(native)
-    return [self.GetJavaParamRefForCall(c_type, 'jcaller')]
+    return 'base::android::JavaParamRef<%s>(env, %s)' % (c_type, name)
 
   def GetImplementationMethodName(self, native):
     class_name = self.class_name
@@ -1037,14 +1252,15 @@ $METHOD_STUBS
   def GetNativeStub(self, native):
     is_method = native.type == 'method'
 
+    param_c_types = [JavaDataTypeToC(p.datatype) for p in native.params]
+    params = zip(param_c_types, native.params)
     if is_method:
-      params = native.params[1:]
-    else:
-      params = native.params
-    params_in_call = ['env'] + self.GetJNIFirstParamForCall(native)
-    for p in params:
-      c_type = JavaDataTypeToC(p.datatype)
-      if re.match(RE_SCOPED_JNI_TYPES, c_type):
+      params = params[1:]
+    params_in_call = [
+        'env',
+        self.GetJavaParamRefForCall(_GetJNIFirstParamType(native), 'jcaller')]
+    for c_type, p in params:
+      if RE_SCOPED_JNI_TYPES.match(c_type):
         params_in_call.append(self.GetJavaParamRefForCall(c_type, p.name))
       else:
         params_in_call.append(p.name)
@@ -1052,7 +1268,7 @@ $METHOD_STUBS
 
     return_type = return_declaration = JavaDataTypeToC(native.return_type)
     post_call = ''
-    if re.match(RE_SCOPED_JNI_TYPES, return_type):
+    if RE_SCOPED_JNI_TYPES.match(return_type):
       post_call = '.Release()'
       return_declaration = ('base::android::ScopedJavaLocalRef<' + return_type +
                             '>')
@@ -1065,7 +1281,7 @@ $METHOD_STUBS
         'NAME': native.name,
         'IMPL_METHOD_NAME': self.GetImplementationMethodName(native),
         'PARAMS': _GetParamsInDeclaration(native),
-        'PARAMS_IN_STUB': GetParamsInStub(native),
+        'PARAMS_IN_STUB': GetParamsInStub(native, param_c_types),
         'PARAMS_IN_CALL': params_in_call,
         'POST_CALL': post_call,
         'STUB_NAME': self.helper.GetStubName(native),
@@ -1085,40 +1301,20 @@ $METHOD_STUBS
       })
       if self.options.enable_tracing:
         values['TRACE_EVENT'] = self.GetTraceEventForNameTemplate(
-            namespace_qual + '${P0_TYPE}::${NAME}', values);
-      template = Template("""\
-JNI_GENERATOR_EXPORT ${RETURN} ${STUB_NAME}(
-    JNIEnv* env,
-    ${PARAMS_IN_STUB}) {
-${PROFILING_ENTERED_NATIVE}\
-${TRACE_EVENT}\
-  ${P0_TYPE}* native = reinterpret_cast<${P0_TYPE}*>(${PARAM0_NAME});
-  CHECK_NATIVE_PTR(env, jcaller, native, "${NAME}"${OPTIONAL_ERROR_RETURN});
-  return native->${NAME}(${PARAMS_IN_CALL})${POST_CALL};
-}
-""")
+            namespace_qual + '%(P0_TYPE)s::%(NAME)s', values);
+      template = _NATIVE_METHOD_STUB_TEMPLATE
     else:
       if self.options.enable_tracing:
         values['TRACE_EVENT'] = self.GetTraceEventForNameTemplate(
-            namespace_qual + '${IMPL_METHOD_NAME}', values)
-      template = Template("""\
-static ${RETURN_DECLARATION} ${IMPL_METHOD_NAME}(JNIEnv* env, ${PARAMS});
-
-JNI_GENERATOR_EXPORT ${RETURN} ${STUB_NAME}(
-    JNIEnv* env,
-    ${PARAMS_IN_STUB}) {
-${PROFILING_ENTERED_NATIVE}\
-${TRACE_EVENT}\
-  return ${IMPL_METHOD_NAME}(${PARAMS_IN_CALL})${POST_CALL};
-}
-""")
+            namespace_qual + '%(IMPL_METHOD_NAME)s', values)
+      template = _NATIVE_FUNCTION_STUB_TEMPLATE
 
-    return RemoveIndentedEmptyLines(template.substitute(values))
+    return template % values
 
   def GetArgument(self, param):
     if param.datatype == 'int':
       return 'as_jint(' + param.name + ')'
-    elif re.match(RE_SCOPED_JNI_TYPES, JavaDataTypeToC(param.datatype)):
+    elif RE_SCOPED_JNI_TYPES.match(JavaDataTypeToC(param.datatype)):
       return param.name + '.obj()'
     else:
       return param.name
@@ -1133,10 +1329,11 @@ ${TRACE_EVENT}\
     java_class = self.fully_qualified_class
     if called_by_native.java_class_name:
       java_class += '$' + called_by_native.java_class_name
+    binary_java_class = GetBinaryClassName(java_class)
 
     if called_by_native.static or called_by_native.is_constructor:
       first_param_in_declaration = ''
-      first_param_in_call = ('%s_clazz(env)' % GetBinaryClassName(java_class))
+      first_param_in_call = binary_java_class + '_clazz(env)'
     else:
       first_param_in_declaration = (
           ', const base::android::JavaRef<jobject>& obj')
@@ -1165,7 +1362,7 @@ ${TRACE_EVENT}\
     if return_type != 'void':
       pre_call = ' ' + pre_call
       return_declaration = return_type + ' ret ='
-      if re.match(RE_SCOPED_JNI_TYPES, return_type):
+      if RE_SCOPED_JNI_TYPES.match(return_type):
         return_type = 'base::android::ScopedJavaLocalRef<' + return_type + '>'
         return_clause = 'return ' + return_type + '(env, ret);'
       else:
@@ -1183,10 +1380,9 @@ ${TRACE_EVENT}\
     else:
       jni_signature = self.jni_params.Signature(
           called_by_native.params, jni_return_type)
-    java_name_full = java_class.replace('/', '.') + '.' + jni_name
-    return {
+    values = {
         'JAVA_CLASS_ONLY': java_class_only,
-        'JAVA_CLASS': GetBinaryClassName(java_class),
+        'JAVA_CLASS': binary_java_class,
         'RETURN_TYPE': return_type,
         'OPTIONAL_ERROR_RETURN': optional_error_return,
         'RETURN_DECLARATION': return_declaration,
@@ -1204,72 +1400,58 @@ ${TRACE_EVENT}\
         'JNI_SIGNATURE': jni_signature,
         'METHOD_ID_VAR_NAME': called_by_native.method_id_var_name,
         'METHOD_ID_TYPE': 'STATIC' if called_by_native.static else 'INSTANCE',
-        'JAVA_NAME_FULL': java_name_full,
     }
+    if self.options.enable_tracing:
+      # Only the trace event uses the dotted Java name.
+      values['JAVA_NAME_FULL'] = java_class.replace('/', '.') + '.' + jni_name
+    return values
 
   def GetLazyCalledByNativeMethodStub(self, called_by_native):
     """Returns a string."""
-    function_signature_template = Template("""\
-static ${RETURN_TYPE} Java_${JAVA_CLASS_ONLY}_${METHOD_ID_VAR_NAME}(\
-JNIEnv* env${FIRST_PARAM_IN_DECLARATION}${PARAMS_IN_DECLARATION})""")
-    function_header_template = Template("""\
-${FUNCTION_SIGNATURE} {""")
-    function_header_with_unused_template = Template("""\
-${FUNCTION_SIGNATURE} __attribute__ ((unused));
-${FUNCTION_SIGNATURE} {""")
-    template = Template("""
-static base::subtle::AtomicWord g_${JAVA_CLASS}_${METHOD_ID_VAR_NAME} = 0;
-${FUNCTION_HEADER}
-  CHECK_CLAZZ(env, ${FIRST_PARAM_IN_CALL},
-      ${JAVA_CLASS}_clazz(env)${OPTIONAL_ERROR_RETURN});
-  jmethodID method_id = base::android::MethodID::LazyGet<
-      base::android::MethodID::TYPE_${METHOD_ID_TYPE}>(
-          env, ${JAVA_CLASS}_clazz(env),
-          "${JNI_NAME}",
-          ${JNI_SIGNATURE},
-          &g_${JAVA_CLASS}_${METHOD_ID_VAR_NAME});
-
-${TRACE_EVENT}\
-${PROFILING_LEAVING_NATIVE}\
-  ${RETURN_DECLARATION}
-     ${PRE_CALL}env->${ENV_CALL}(${FIRST_PARAM_IN_CALL},
-          method_id${PARAMS_IN_CALL})${POST_CALL};
-  ${CHECK_EXCEPTION}
-  ${RETURN_CLAUSE}
-}""")
     values = self.GetCalledByNativeValues(called_by_native)
     values['FUNCTION_SIGNATURE'] = (
-        function_signature_template.substitute(values))
+        _CALLED_BY_NATIVE_SIGNATURE_TEMPLATE % values)
     if called_by_native.system_class:
       values['FUNCTION_HEADER'] = (
-          function_header_with_unused_template.substitute(values))
+          _CALLED_BY_NATIVE_HEADER_WITH_UNUSED_TEMPLATE % values)
     else:
-      values['FUNCTION_HEADER'] = function_header_template.substitute(values)
+      values['FUNCTION_HEADER'] = (
+          _CALLED_BY_NATIVE_HEADER_TEMPLATE % values)
     if self.options.enable_tracing:
       values['TRACE_EVENT'] = self.GetTraceEventForNameTemplate(
-          '${JAVA_NAME_FULL}', values)
+          '%(JAVA_NAME_FULL)s', values)
     else:
       values['TRACE_EVENT'] = ''
-    return RemoveIndentedEmptyLines(template.substitute(values))
+    return _CALLED_BY_NATIVE_STUB_TEMPLATE % values
 
   def GetTraceEventForNameTemplate(self, name_template, values):
-    name = Template(name_template).substitute(values)
+    name = name_template % values
     return '  TRACE_EVENT0("jni", "%s");' % name
 
 
+def _GetWrapperForIndent(indent):
+  wrapper = _WRAPPERS_BY_INDENT.get(indent)
+  if wrapper is None:
+    wrapper = textwrap.TextWrapper(width=_WRAP_LINE_LENGTH, expand_tabs=False,
+                                   replace_whitespace=False,
+                                   subsequent_indent=' ' * (indent + 4),
+                                   break_long_words=False)
+    _WRAPPERS_BY_INDENT[indent] = wrapper
+  return wrapper
+
+
 def WrapOutput(output):
   ret = []
   for line in output.splitlines():
     # Do not wrap preprocessor directives or comments.
-    if len(line) < _WRAP_LINE_LENGTH or line[0] == '#' or line.startswith('//'):
+    if len(line) < _WRAP_LINE_LENGTH or line.startswith(('#', '//')):
       ret.append(line)
     else:
       # Assumes that the line is not already indented as a continuation line,
       # which is not always true (oh well).
       first_line_indent = (len(line) - len(line.lstrip()))
-      wrapper = _WRAPPERS_BY_INDENT[first_line_indent]
-      ret.extend(wrapper.wrap(line))
-  ret += ['']
+      ret.extend(_GetWrapperForIndent(first_line_indent).wrap(line))
+  ret.append('')
   return '\n'.join(ret)
 
 
@@ -1320,12 +1502,31 @@ def GenerateJNIHeader(input_file, output_file, options):
     print content
 
 
+_COMPARE_CHUNK_SIZE = 64 * 1024
+
+
+def _HasSameContent(path, content):
+  """Returns True if the file at |path| already holds exactly |content|."""
+  # A size mismatch means the content changed, so only read the existing file
+  # back when the sizes agree, and stop at the first chunk that differs.
+  if not os.path.exists(path) or os.path.getsize(path) != len(content):
+    return False
+  with open(path) as f:
+    offset = 0
+    while True:
+      chunk = f.read(_COMPARE_CHUNK_SIZE)
+      if not chunk:
+        return offset == len(content)
+      if content[offset:offset + len(chunk)] != chunk:
+        return False
+      offset += len(chunk)
+
+
 def WriteOutput(output_file, content):
-  if os.path.exists(output_file):
-    with open(output_file) as f:
-      existing_content = f.read()
-      if existing_content == content:
-        return
+  # Leave unchanged outputs untouched so their mtime does not trigger
+  # needless rebuilds of everything that includes them.
+  if _HasSameContent(output_file, content):
+    return
   with open(output_file, 'w') as f:
     f.write(content)
 
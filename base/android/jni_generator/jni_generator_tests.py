@@ -15,7 +15,9 @@ import difflib
 import inspect
 import optparse
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 import jni_generator
 import jni_registration_generator
@@ -730,6 +732,14 @@ scooby doo
     except jni_generator.ParseError, e:
       self.assertEquals(('@CalledByNative', 'scooby doo'), e.context_lines)
 
+  def testCalledByNativeParseErrorOnLastLine(self):
+    jni_params = jni_generator.JniParams('')
+    self.assertRaises(jni_generator.ParseError,
+                      jni_generator.ExtractCalledByNatives, jni_params, """
+@CalledByNative
+public static int foo();
+@CalledByNative""")
+
   def testFullyQualifiedClassName(self):
     contents = """
 // Copyright (c) 2010 The Chromium Authors. All rights reserved.
@@ -969,6 +979,12 @@ class Foo {
     self.assertTextEquals(
         '[Ljava/nio/ByteBuffer;', jni_params.JavaToJni('java/nio/ByteBuffer[]'))
 
+  def testJniParamsJavaToJniAfterImports(self):
+    jni_params = jni_generator.JniParams('org/chromium/Foo')
+    self.assertEquals('Lorg/chromium/Bar;', jni_params.JavaToJni('Bar'))
+    jni_params.ExtractImportsAndInnerClasses('import org.chromium.baz.Bar;')
+    self.assertEquals('Lorg/chromium/baz/Bar;', jni_params.JavaToJni('Bar'))
+
   def testNativesLong(self):
     test_options = TestOptions()
     test_options.ptr_type = 'long'
@@ -1156,6 +1172,24 @@ class Foo {
                                                     options_with_tracing)
     self.assertGoldenTextEquals(jni_from_java.GetContent())
 
+  def testWriteOutputSkipsUnchangedContent(self):
+    temp_dir = tempfile.mkdtemp()
+    try:
+      output_file = os.path.join(temp_dir, 'Foo_jni.h')
+      content = 'x' * (jni_generator._COMPARE_CHUNK_SIZE + 1)
+      jni_generator.WriteOutput(output_file, content)
+      os.utime(output_file, (0, 0))
+      jni_generator.WriteOutput(output_file, content)
+      self.assertEquals(0, os.path.getmtime(output_file))
+
+      changed_content = content[:-1] + 'y'
+      jni_generator.WriteOutput(output_file, changed_content)
+      self.assertNotEquals(0, os.path.getmtime(output_file))
+      with open(output_file) as f:
+        self.assertEquals(changed_content, f.read())
+    finally:
+      shutil.rmtree(temp_dir)
+
 
 def TouchStamp(stamp_path):
   dir_name = os.path.dirname(stamp_path)
@@ -12,7 +12,6 @@ to register all native methods that exist within an application."""
 import argparse
 import jni_generator
 import multiprocessing
-import string
 import sys
 from util import build_utils
 
@@ -28,6 +27,104 @@ MERGEABLE_KEYS = [
 ]
 
 
+_HEADER_TEMPLATE = """\
+// Copyright 2017 The Chromium Authors. All rights reserved.
+// Use of this source code is governed by a BSD-style license that can be
+// found in the LICENSE file.
+
+
+// This file is autogenerated by
+//     base/android/jni_generator/jni_registration_generator.py
+// Please do not change its content.
+
+#ifndef HEADER_GUARD
+#define HEADER_GUARD
+
+#include <jni.h>
+
+#include "base/android/jni_generator/jni_generator_helper.h"
+#include "base/android/jni_int_wrapper.h"
+
+
+// Step 1: Forward declarations (classes).
+%(CLASS_PATH_DECLARATIONS)s
+
+// Step 2: Forward declarations (methods).
+
+%(FORWARD_DECLARATIONS)s
+
+// Step 3: Method declarations.
+
+%(JNI_NATIVE_METHOD_ARRAY)s
+%(JNI_NATIVE_METHOD)s
+// Step 4: Main dex and non-main dex registration functions.
+
+bool RegisterMainDexNatives(JNIEnv* env) {
+%(REGISTER_MAIN_DEX_NATIVES)s
+  return true;
+}
+
+bool RegisterNonMainDexNatives(JNIEnv* env) {
+%(REGISTER_NON_MAIN_DEX_NATIVES)s
+  return true;
+}
+
+#endif  // HEADER_GUARD
+"""
+
+_FORWARD_DECLARATION_TEMPLATE = """\
+JNI_GENERATOR_EXPORT %(RETURN)s %(STUB_NAME)s(
+    JNIEnv* env,
+    %(PARAMS_IN_STUB)s);
+"""
+
+_REGISTER_NATIVES_CALL_TEMPLATE = """\
+  if (!%(REGISTER_NAME)s(env))
+    return false;
+"""
+
+_KMETHODS_ARRAY_TEMPLATE = """\
+static const JNINativeMethod kMethods_%(JAVA_CLASS)s[] = {
+%(KMETHODS)s
+};
+
+"""
+
+_KMETHOD_ARRAY_ENTRY_TEMPLATE = (
+    '    { "native%(NAME)s", %(JNI_SIGNATURE)s, '
+    'reinterpret_cast<void*>(%(STUB_NAME)s) },')
+
+_JNI_NATIVE_METHODS_TEMPLATE = """\
+static const JNINativeMethod kMethods_%(JAVA_CLASS)s[] = {
+%(KMETHODS)s
+
+};
+"""
+
+_REGISTER_NATIVES_TEMPLATE = """\
+JNI_REGISTRATION_EXPORT bool %(REGISTER_NAME)s(JNIEnv* env) {
+%(NATIVES)s\
+  return true;
+}
+
+"""
+
+_REGISTER_NATIVES_IMPL_TEMPLATE = """\
+  const int kMethods_%(JAVA_CLASS)sSize =
+      arraysize(%(NAMESPACE)skMethods_%(JAVA_CLASS)s);
+  if (env->RegisterNatives(
+      %(JAVA_CLASS)s_clazz(env),
+      %(NAMESPACE)skMethods_%(JAVA_CLASS)s,
+      kMethods_%(JAVA_CLASS)sSize) < 0) {
+    jni_generator::HandleRegistrationError(env,
+        %(JAVA_CLASS)s_clazz(env),
+        __FILE__);
+    return false;
+  }
+
+"""
+
+
 def GenerateJNIHeader(java_file_paths, output_file, args):
   """Generate a header file including two registration functions.
 
@@ -80,55 +177,10 @@ def _DictForPath(path):
 
 def CreateFromDict(registration_dict):
   """Returns the content of the header file."""
-
-  template = string.Template("""\
-// Copyright 2017 The Chromium Authors. All rights reserved.
-// Use of this source code is governed by a BSD-style license that can be
-// found in the LICENSE file.
-
-
-// This file is autogenerated by
-//     base/android/jni_generator/jni_registration_generator.py
-// Please do not change its content.
-
-#ifndef HEADER_GUARD
-#define HEADER_GUARD
-
-#include <jni.h>
-
-#include "base/android/jni_generator/jni_generator_helper.h"
-#include "base/android/jni_int_wrapper.h"
-
-
-// Step 1: Forward declarations (classes).
-${CLASS_PATH_DECLARATIONS}
-
-// Step 2: Forward declarations (methods).
-
-${FORWARD_DECLARATIONS}
-
-// Step 3: Method declarations.
-
-${JNI_NATIVE_METHOD_ARRAY}
-${JNI_NATIVE_METHOD}
-// Step 4: Main dex and non-main dex registration functions.
-
-bool RegisterMainDexNatives(JNIEnv* env) {
-${REGISTER_MAIN_DEX_NATIVES}
-  return true;
-}
-
-bool RegisterNonMainDexNatives(JNIEnv* env) {
-${REGISTER_NON_MAIN_DEX_NATIVES}
-  return true;
-}
-
-#endif  // HEADER_GUARD
-""")
   if len(registration_dict['FORWARD_DECLARATIONS']) == 0:
     return ''
 
-  return template.substitute(registration_dict)
+  return _HEADER_TEMPLATE % registration_dict
 
 
 class HeaderGenerator(object):
@@ -140,10 +192,12 @@ class HeaderGenerator(object):
     self.natives = natives
     self.fully_qualified_class = fully_qualified_class
     self.jni_params = jni_params
-    self.class_name = self.fully_qualified_class.split('/')[-1]
+    self.class_name = self.fully_qualified_class.rpartition('/')[2]
     self.main_dex = main_dex
     self.helper = jni_generator.HeaderFileGeneratorHelper(
         self.class_name, fully_qualified_class)
+    # GetUniqueClasses() always includes the outer class.
+    self.all_classes = self.helper.GetUniqueClasses(natives)
     self.registration_dict = None
 
   def Generate(self):
@@ -159,17 +213,11 @@ class HeaderGenerator(object):
     self.registration_dict[key] = jni_generator.WrapOutput(value)
 
   def _AddClassPathDeclarations(self):
-    classes = self.helper.GetUniqueClasses(self.natives)
     self._SetDictValue('CLASS_PATH_DECLARATIONS',
-        self.helper.GetClassPathLines(classes, declare_only=True))
+        self.helper.GetClassPathLines(self.all_classes, declare_only=True))
 
   def _AddForwardDeclaration(self):
     """Add the content of the forward declaration to the dictionary."""
-    template = string.Template("""\
-JNI_GENERATOR_EXPORT ${RETURN} ${STUB_NAME}(
-    JNIEnv* env,
-    ${PARAMS_IN_STUB});
-""")
     forward_declaration = ''
     for native in self.natives:
       value = {
@@ -177,21 +225,17 @@ JNI_GENERATOR_EXPORT ${RETURN} ${STUB_NAME}(
           'STUB_NAME': self.helper.GetStubName(native),
           'PARAMS_IN_STUB': jni_generator.GetParamsInStub(native),
       }
-      forward_declaration += template.substitute(value)
+      forward_declaration += _FORWARD_DECLARATION_TEMPLATE % value
     self._SetDictValue('FORWARD_DECLARATIONS', forward_declaration)
 
   def _AddRegisterNativesCalls(self):
     """Add the body of the RegisterNativesImpl method to the dictionary."""
-    template = string.Template("""\
-  if (!${REGISTER_NAME}(env))
-    return false;
-""")
     value = {
         'REGISTER_NAME':
             jni_generator.GetRegistrationFunctionName(
                 self.fully_qualified_class)
     }
-    register_body = template.substitute(value)
+    register_body = _REGISTER_NATIVES_CALL_TEMPLATE % value
     if self.main_dex:
       self._SetDictValue('REGISTER_MAIN_DEX_NATIVES', register_body)
     else:
@@ -199,12 +243,6 @@ JNI_GENERATOR_EXPORT ${RETURN} ${STUB_NAME}(
 
   def _AddJNINativeMethodsArrays(self):
     """Returns the implementation of the array of native methods."""
-    template = string.Template("""\
-static const JNINativeMethod kMethods_${JAVA_CLASS}[] = {
-${KMETHODS}
-};
-
-""")
     open_namespace = ''
     close_namespace = ''
     if self.namespace:
@@ -215,7 +253,7 @@ ${KMETHODS}
       all_namespaces.reverse()
       close_namespace = '\n'.join(all_namespaces) + '\n\n'
 
-    body = self._SubstituteNativeMethods(template)
+    body = self._SubstituteNativeMethods(_KMETHODS_ARRAY_TEMPLATE)
     self._SetDictValue('JNI_NATIVE_METHOD_ARRAY',
                        ''.join((open_namespace, body, close_namespace)))
 
@@ -224,85 +262,54 @@ ${KMETHODS}
     for native in self.natives:
       if (native.java_class_name == clazz or
           (not native.java_class_name and clazz == self.class_name)):
-        ret += [self._GetKMethodArrayEntry(native)]
+        ret.append(self._GetKMethodArrayEntry(native))
     return '\n'.join(ret)
 
   def _GetKMethodArrayEntry(self, native):
-    template = string.Template('    { "native${NAME}", ${JNI_SIGNATURE}, ' +
-                               'reinterpret_cast<void*>(${STUB_NAME}) },')
     values = {
         'NAME': native.name,
         'JNI_SIGNATURE': self.jni_params.Signature(
             native.params, native.return_type),
         'STUB_NAME': self.helper.GetStubName(native)
     }
-    return template.substitute(values)
+    return _KMETHOD_ARRAY_ENTRY_TEMPLATE % values
 
   def _SubstituteNativeMethods(self, template):
     """Substitutes NAMESPACE, JAVA_CLASS and KMETHODS in the provided
     template."""
     ret = []
-    all_classes = self.helper.GetUniqueClasses(self.natives)
-    all_classes[self.class_name] = self.fully_qualified_class
-    for clazz, full_clazz in all_classes.iteritems():
+    namespace_str = ''
+    if self.namespace:
+      namespace_str = self.namespace + '::'
+    for clazz, full_clazz in self.all_classes.iteritems():
       kmethods = self._GetKMethodsString(clazz)
-      namespace_str = ''
-      if self.namespace:
-        namespace_str = self.namespace + '::'
       if kmethods:
         values = {'NAMESPACE': namespace_str,
                   'JAVA_CLASS': jni_generator.GetBinaryClassName(full_clazz),
                   'KMETHODS': kmethods}
-        ret += [template.substitute(values)]
-    if not ret: return ''
+        ret.append(template % values)
     return '\n'.join(ret)
 
   def GetJNINativeMethodsString(self):
     """Returns the implementation of the array of native methods."""
-    template = string.Template("""\
-static const JNINativeMethod kMethods_${JAVA_CLASS}[] = {
-${KMETHODS}
-
-};
-""")
-    return self._SubstituteNativeMethods(template)
+    return self._SubstituteNativeMethods(_JNI_NATIVE_METHODS_TEMPLATE)
 
   def _AddRegisterNativesFunctions(self):
     """Returns the code for RegisterNatives."""
     natives = self._GetRegisterNativesImplString()
     if not natives:
       return ''
-    template = string.Template("""\
-JNI_REGISTRATION_EXPORT bool ${REGISTER_NAME}(JNIEnv* env) {
-${NATIVES}\
-  return true;
-}
-
-""")
     values = {
       'REGISTER_NAME': jni_generator.GetRegistrationFunctionName(
           self.fully_qualified_class),
       'NATIVES': natives
     }
-    self._SetDictValue('JNI_NATIVE_METHOD', template.substitute(values))
+    self._SetDictValue('JNI_NATIVE_METHOD',
+                       _REGISTER_NATIVES_TEMPLATE % values)
 
   def _GetRegisterNativesImplString(self):
     """Returns the shared implementation for RegisterNatives."""
-    template = string.Template("""\
-  const int kMethods_${JAVA_CLASS}Size =
-      arraysize(${NAMESPACE}kMethods_${JAVA_CLASS});
-  if (env->RegisterNatives(
-      ${JAVA_CLASS}_clazz(env),
-      ${NAMESPACE}kMethods_${JAVA_CLASS},
-      kMethods_${JAVA_CLASS}Size) < 0) {
-    jni_generator::HandleRegistrationError(env,
-        ${JAVA_CLASS}_clazz(env),
-        __FILE__);
-    return false;
-  }
-
-""")
-    return self._SubstituteNativeMethods(template)
+    return self._SubstituteNativeMethods(_REGISTER_NATIVES_IMPL_TEMPLATE)
 
 
 def main(argv):